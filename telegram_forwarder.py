@@ -1,39 +1,138 @@
 import asyncio
+import functools
 import logging
+import logging.handlers
 import os
 import argparse
+import json
+import queue
+import random
+import re
+import time
+from collections import defaultdict
 from dotenv import load_dotenv
-from telethon import TelegramClient, events
-from telethon.errors import SessionPasswordNeededError, FloodWaitError
-from telethon.tl.types import PeerUser, PeerChat, PeerChannel
+from telethon import TelegramClient, events, utils
+from telethon.sessions import SQLiteSession, StringSession
+from telethon.extensions import html
+from telethon.errors import SessionPasswordNeededError, FloodWaitError, MultiError
+from telethon.tl.functions.messages import ForwardMessagesRequest
+from telethon.tl.types import MessageMediaWebPage
 
-# Load environment variables
-load_dotenv()
+# Background listener that writes queued log records to the real handlers
+_log_listener = None
 
 def setup_logging(disable_console=False):
     """Configure logging based on console preference."""
-    if disable_console:
-        # Only log to file, not console
-        logging.basicConfig(
-            level=logging.INFO,
-            format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-            handlers=[
-                logging.FileHandler('telegram_forwarder.log'),
-            ]
-        )
-    else:
+    global _log_listener
+    
+    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    handlers = [logging.FileHandler('telegram_forwarder.log', delay=True)]
+    if not disable_console:
         # Log to both console and file
-        logging.basicConfig(
-            level=logging.INFO,
-            format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-            handlers=[
-                logging.StreamHandler(),
-                logging.FileHandler('telegram_forwarder.log')
-            ]
-        )
+        handlers.insert(0, logging.StreamHandler())
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    
+    # Only enqueue records on the event loop thread; the listener thread
+    # does the actual console and file I/O
+    log_queue = queue.SimpleQueue()
+    root_logger = logging.getLogger()
+    root_logger.setLevel(logging.INFO)
+    root_logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    _log_listener = logging.handlers.QueueListener(log_queue, *handlers)
+    _log_listener.start()
+
+def stop_logging():
+    """Flush pending log records and stop the background listener."""
+    global _log_listener
+    if _log_listener is not None:
+        _log_listener.stop()
+        _log_listener = None
 
 logger = logging.getLogger(__name__)
 
+# How long to collect messages from a source before forwarding them together
+FORWARD_BATCH_DELAY = 0.2
+# Telegram accepts at most this many message IDs per forward request
+MAX_FORWARD_BATCH = 100
+# A single forwarding rule ("source:target1:target2") up to the next comma
+FORWARDING_RULE_RE = re.compile(r'\s*(?:(-?\d+(?:\s*:\s*-?\d+)+)\s*)?(?:,|$)')
+CHAT_ID_RE = re.compile(r'-?\d+')
+# How often the in-memory session is written to disk, in seconds
+SESSION_SNAPSHOT_INTERVAL = 300
+# Maximum number of entities Telethon keeps in its in-memory cache
+ENTITY_CACHE_LIMIT = 1000
+
+class SnapshotSession(StringSession):
+    """In-memory session that is periodically written to a JSON snapshot file."""
+    
+    def __init__(self, name):
+        self.path = f'{name}.json'
+        snapshot = {}
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                snapshot = json.load(f)
+        
+        super().__init__(snapshot.get('session'))
+        # When set, only entities with these IDs are stored
+        self.entity_ids = None
+        self._entities.update(tuple(row) for row in snapshot.get('entities', ()))
+        
+        # Carry over the login from a session file created by older versions
+        if not snapshot and os.path.exists(f'{name}.session'):
+            self._import_sqlite_session(name)
+    
+    def _import_sqlite_session(self, name):
+        """Copy the auth key and known entities from a Telethon SQLite session."""
+        old_session = SQLiteSession(name)
+        try:
+            if old_session.auth_key:
+                self.set_dc(old_session.dc_id, old_session.server_address, old_session.port)
+                self.auth_key = old_session.auth_key
+            
+            cursor = old_session._cursor()
+            try:
+                cursor.execute('select id, hash, username, phone, name from entities')
+                self._entities.update(cursor.fetchall())
+            finally:
+                cursor.close()
+        finally:
+            old_session.close()
+        logger.info("Imported existing session from %s.session", name)
+    
+    def process_entities(self, tlo):
+        rows = self._entities_to_rows(tlo)
+        if self.entity_ids is not None:
+            rows = [row for row in rows if row[0] in self.entity_ids]
+        self._entities.update(rows)
+    
+    def remember_peers(self, peers):
+        """Store the access hashes of resolved InputPeers so they survive restarts."""
+        for peer in peers:
+            # Skip chats that could only be kept as a raw ID
+            if isinstance(peer, int):
+                continue
+            try:
+                peer_id = utils.get_peer_id(peer)
+            except TypeError:
+                continue
+            
+            row = self._entity_values_to_row(peer_id, getattr(peer, 'access_hash', 0), None, None, None)
+            self._entities = {r for r in self._entities if r[0] != peer_id}
+            self._entities.add(row)
+    
+    def snapshot(self):
+        """Write the auth key and known entities to the snapshot file."""
+        data = {'session': self.save(), 'entities': list(self._entities)}
+        
+        # Write to a private temporary file first so a crash never leaves
+        # a truncated snapshot behind
+        tmp_path = f'{self.path}.tmp'
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self.path)
+
 class TelegramForwarder:
     def __init__(self, remove_forward_signature=False):
         """Initialize the Telegram forwarder with environment variables."""
@@ -42,11 +141,40 @@ class TelegramForwarder:
         self.bot_token = os.getenv('BOT_TOKEN')
         self.remove_forward_signature = remove_forward_signature
         
+        # Telethon accepts any object with parse/unparse as a parse mode, so
+        # pass the HTML module itself instead of having 'html' looked up per send
+        self._html_parser = html
+        
+        # Cache of resolved entity info strings, keyed by entity ID
+        self._entity_cache = {}
+        self._entity_futures = {}
+        
+        # Entity info strings for all configured chats, built once at startup
+        self._info = {}
+        
+        # Resolved InputPeer objects for all configured chats
+        self._input_peers = {}
+        self._source_id_set = frozenset()
+        
+        # Message IDs waiting to be forwarded, and the task flushing them, per source
+        self._pending = defaultdict(list)
+        self._flush_tasks = {}
+        
+        # Targets that hit a flood wait, mapped to when they may be sent to again,
+        # the latest delayed send per target so later batches queue behind it,
+        # and every delayed send still running so shutdown can account for them
+        self._cooldown_until = {}
+        self._retry_tasks = {}
+        self._delayed_tasks = set()
+        
         # Check for legacy single source/target configuration
         self.source_id = os.getenv('SOURCE_ID')
         self.target_id = os.getenv('TARGET_ID')
         self.forwarding_rules = os.getenv('FORWARDING_RULES')
         
+        # Per-message INFO logs are off unless explicitly enabled
+        self.log_forwards = os.getenv('LOG_EVERY_FORWARD', '0') == '1'
+        
         # Validate required environment variables
         if not all([self.api_id, self.api_hash]):
             raise ValueError("Missing API_ID or API_HASH. Check your .env file.")
@@ -57,15 +185,30 @@ class TelegramForwarder:
         if not self.forwarding_map:
             raise ValueError("No forwarding rules configured. Set either SOURCE_ID/TARGET_ID or FORWARDING_RULES.")
         
+        # Drop duplicate targets while keeping their order, so a target listed
+        # twice for the same source doesn't receive every message twice
+        self.forwarding_map = {
+            source_id: tuple(dict.fromkeys(target_ids))
+            for source_id, target_ids in self.forwarding_map.items()
+        }
+        self._total_targets = sum(len(target_ids) for target_ids in self.forwarding_map.values())
+        self._chat_ids = frozenset(self.forwarding_map).union(*self.forwarding_map.values())
+        
         # Initialize Telegram client
         if self.bot_token:
             # Bot mode
-            self.client = TelegramClient('bot_session', self.api_id, self.api_hash)
+            self.client = TelegramClient(SnapshotSession('bot_session'), self.api_id, self.api_hash,
+                                         entity_cache_limit=ENTITY_CACHE_LIMIT)
             logger.info("Initialized in bot mode")
         else:
             # User mode
-            self.client = TelegramClient('user_session', self.api_id, self.api_hash)
+            self.client = TelegramClient(SnapshotSession('user_session'), self.api_id, self.api_hash,
+                                         entity_cache_limit=ENTITY_CACHE_LIMIT)
             logger.info("Initialized in user mode")
+        
+        # Only the configured chats need to be remembered across restarts, so
+        # don't let every other peer seen in updates pile up in the session
+        self.client.session.entity_ids = self._chat_ids
     
     def _parse_forwarding_rules(self):
         """Parse forwarding rules from environment variables."""
@@ -86,18 +229,20 @@ class TelegramForwarder:
         if self.forwarding_rules:
             try:
                 # Format: source1:target1:target2,source2:target3,source3:target4
-                rules = self.forwarding_rules.split(',')
-                for rule in rules:
-                    rule = rule.strip()
-                    if not rule:
-                        continue
-                    
-                    parts = rule.split(':')
-                    if len(parts) < 2:
+                rules = self.forwarding_rules
+                pos = 0
+                while pos < len(rules):
+                    match = FORWARDING_RULE_RE.match(rules, pos)
+                    if match is None:
+                        rule = rules[pos:].split(',', 1)[0].strip()
                         raise ValueError(f"Invalid forwarding rule format: {rule}")
+                    pos = match.end()
+                    
+                    # Empty rules (e.g. a trailing comma) are skipped
+                    if match.group(1) is None:
+                        continue
                     
-                    source_id = int(parts[0])
-                    target_ids = [int(target) for target in parts[1:]]
+                    source_id, *target_ids = map(int, CHAT_ID_RE.findall(match.group(1)))
                     
                     if source_id in forwarding_map:
                         # Extend existing targets for this source
@@ -105,7 +250,7 @@ class TelegramForwarder:
                     else:
                         forwarding_map[source_id] = target_ids
                 
-                logger.info(f"Parsed {len(forwarding_map)} forwarding rules")
+                logger.info("Parsed %d forwarding rules", len(forwarding_map))
                 return forwarding_map
                 
             except ValueError as e:
@@ -134,93 +279,380 @@ class TelegramForwarder:
     
     async def get_entity_info(self, entity_id):
         """Get information about an entity (user, chat, or channel)."""
+        if entity_id in self._entity_cache:
+            return self._entity_cache[entity_id]
+        
+        # Concurrent callers for the same entity share one in-flight lookup
+        future = self._entity_futures.get(entity_id)
+        if future is not None:
+            return await future
+        
+        future = asyncio.get_running_loop().create_future()
+        self._entity_futures[entity_id] = future
         try:
             entity = await self.client.get_entity(entity_id)
+        except Exception as e:
+            logger.error("Error getting entity info for %s: %s", entity_id, e)
+            info = f"Unknown Entity (ID: {entity_id})"
+        except BaseException:
+            # Don't leave other callers waiting on a cancelled lookup
+            future.cancel()
+            raise
+        else:
             if hasattr(entity, 'title'):
-                return f"{entity.title} (ID: {entity_id})"
+                info = f"{entity.title} (ID: {entity_id})"
             elif hasattr(entity, 'first_name'):
                 name = entity.first_name
                 if hasattr(entity, 'last_name') and entity.last_name:
                     name += f" {entity.last_name}"
-                return f"{name} (ID: {entity_id})"
+                info = f"{name} (ID: {entity_id})"
             else:
-                return f"Entity (ID: {entity_id})"
+                info = f"Entity (ID: {entity_id})"
+            self._entity_cache[entity_id] = info
+        finally:
+            del self._entity_futures[entity_id]
+        
+        future.set_result(info)
+        return info
+    
+    async def resolve_input_peer(self, entity_id):
+        """Resolve an entity ID to an InputPeer, falling back to the raw ID."""
+        try:
+            return await self.client.get_input_entity(entity_id)
         except Exception as e:
-            logger.error(f"Error getting entity info for {entity_id}: {e}")
-            return f"Unknown Entity (ID: {entity_id})"
+            logger.error("Error resolving input peer for %s: %s", entity_id, e)
+            return entity_id
     
-    async def setup_forwarding(self):
-        """Set up message forwarding from multiple sources to their respective targets."""
-        # Log all forwarding rules
-        logger.info("Setting up forwarding rules:")
-        for source_id, target_ids in self.forwarding_map.items():
-            source_info = await self.get_entity_info(source_id)
-            target_infos = []
-            for target_id in target_ids:
-                target_info = await self.get_entity_info(target_id)
-                target_infos.append(target_info)
-            logger.info(f"  {source_info} -> {', '.join(target_infos)}")
-        
-        # Get all source IDs for the event handler
-        source_ids = list(self.forwarding_map.keys())
+    def _in_cooldown(self, target_id):
+        """Check whether a target is still waiting out a flood wait."""
+        return self._cooldown_until.get(target_id, 0) > time.monotonic()
+    
+    def _start_cooldown(self, target_id, seconds):
+        """Hold back sends to a target that hit a flood wait."""
+        # Jitter keeps retries to different targets from firing in lockstep
+        self._cooldown_until[target_id] = time.monotonic() + seconds + random.uniform(0, 1)
+        logger.warning("Rate limited by %s. Waiting %d seconds...", self._info.get(target_id, target_id), seconds)
+    
+    async def _wait_for_cooldown(self, target_id):
+        """Sleep until the target's flood wait (if any) has passed."""
+        remaining = self._cooldown_until.get(target_id, 0) - time.monotonic()
+        if remaining > 0:
+            await asyncio.sleep(remaining)
+    
+    async def _send_with_retry(self, target_id, send):
+        """Await send() once the target is out of cooldown, retrying once after a flood wait."""
+        await self._wait_for_cooldown(target_id)
+        try:
+            await send()
+        except FloodWaitError as e:
+            self._start_cooldown(target_id, e.seconds)
+            await self._wait_for_cooldown(target_id)
+            try:
+                await send()
+            except FloodWaitError as e:
+                # Keep later sends away from the peer until this wait is over too
+                self._start_cooldown(target_id, e.seconds)
+                raise
+    
+    def _forget_retry(self, target_id, task):
+        """Drop a finished delayed send unless a newer one has queued behind it."""
+        if self._retry_tasks.get(target_id) is task:
+            del self._retry_tasks[target_id]
+    
+    async def _send_later(self, target_id, send, message_count, previous):
+        """Await send() after earlier delayed sends to the target, waiting out its flood wait."""
+        info = self._info.get(target_id, target_id)
+        try:
+            # Wait for earlier delayed sends to this target to keep them in order
+            if previous is not None:
+                await asyncio.wait((previous,))
+            await self._send_with_retry(target_id, send)
+        except asyncio.CancelledError:
+            logger.warning("Dropped %d delayed message(s) to %s on shutdown", message_count, info)
+            raise
+        except Exception as e:
+            logger.error("Error forwarding to %s: %s", info, e)
+        else:
+            if self.log_forwards:
+                logger.info("Successfully delivered %d delayed message(s) to %s", message_count, info)
+    
+    def _delay_send(self, target_id, send, message_count):
+        """Queue send() for a rate-limited target as a task tracked in _retry_tasks."""
+        task = asyncio.create_task(
+            self._send_later(target_id, send, message_count, self._retry_tasks.get(target_id))
+        )
+        self._retry_tasks[target_id] = task
+        self._delayed_tasks.add(task)
+        task.add_done_callback(functools.partial(self._forget_retry, target_id))
+        task.add_done_callback(self._delayed_tasks.discard)
+    
+    def _make_handler(self, send_to_targets):
+        """Build a NewMessage handler that fans messages out with send_to_targets."""
+        forwarding_map = self.forwarding_map
+        info = self._info
+        source_id_set = self._source_id_set
+        log_forwards = self.log_forwards
         
-        @self.client.on(events.NewMessage(chats=source_ids))
         async def forward_handler(event):
             """Handle new messages and forward them to configured targets."""
+            if event.chat_id not in source_id_set:
+                return
+            
             try:
                 # Get message details
                 message = event.message
                 source_id = event.chat_id
-                sender_id = message.sender_id if message.sender_id else "Unknown"
                 
-                # Get target IDs for this source
-                target_ids = self.forwarding_map.get(source_id, [])
-                if not target_ids:
-                    logger.warning(f"No targets configured for source {source_id}")
-                    return
+                # The event filter only lets configured sources through
+                target_ids = forwarding_map[source_id]
                 
-                source_info = await self.get_entity_info(source_id)
-                logger.info(f"Received message from {sender_id} in {source_info}")
+                if log_forwards:
+                    logger.info("Received message from %s in %s", message.sender_id or "Unknown", info.get(source_id, source_id))
+                await send_to_targets(message, source_id, target_ids)
                 
-                # Forward to all configured targets
-                for target_id in target_ids:
-                    try:
-                        target_info = await self.get_entity_info(target_id)
-                        
-                        if self.remove_forward_signature:
-                            # Send as new message without "Forward from..." signature
-                            await self.client.send_message(
-                                entity=target_id,
-                                message=message.message,
-                                file=message.media,
-                                parse_mode='html' if message.entities else None
-                            )
-                            logger.info(f"Successfully sent message (without forward signature) to {target_info}")
-                        else:
-                            # Forward the message with "Forward from..." signature
-                            await self.client.forward_messages(
-                                entity=target_id,
-                                messages=message.id,
-                                from_peer=source_id
-                            )
-                            logger.info(f"Successfully forwarded message to {target_info}")
-                            
-                    except Exception as e:
-                        target_info = await self.get_entity_info(target_id)
-                        logger.error(f"Error forwarding to {target_info}: {e}")
-                
-            except FloodWaitError as e:
-                logger.warning(f"Rate limited. Waiting {e.seconds} seconds...")
-                await asyncio.sleep(e.seconds)
             except Exception as e:
-                logger.error(f"Error in forward handler: {e}")
+                logger.error("Error in forward handler: %s", e)
+        
+        return forward_handler
+    
+    def _make_forward_handler(self):
+        """Build the handler that forwards messages with the "Forward from..." signature."""
+        client = self.client
+        input_peers = self._input_peers
+        info = self._info
+        log_forwards = self.log_forwards
+        pending = self._pending
+        flush_tasks = self._flush_tasks
+        retry_tasks = self._retry_tasks
+        
+        async def send_requests(requests):
+            """Send requests in one container and return the error (or None) for each."""
+            try:
+                await client(requests)
+            except MultiError as e:
+                return e.exceptions
+            except Exception as e:
+                # Errors raised before anything is sent (resolving a peer,
+                # Telethon's up-front flood wait check, connection errors) land
+                # here. So does an RPC error from a batch of one, because
+                # MultiError unwraps itself into the only exception it holds
+                if len(requests) == 1:
+                    return [e]
+                # Telethon tracks flood waits per request type, not per target, and
+                # raises a known one before sending anything, so every target in
+                # the batch has to wait it out
+                if isinstance(e, FloodWaitError):
+                    return [e] * len(requests)
+                # Something failed for the batch as a whole (e.g. resolving one
+                # of the peers), so send each request on its own. The requests
+                # keep their random_id, so Telegram drops any that already went out
+                errors = []
+                for request in requests:
+                    errors.extend(await send_requests([request]))
+                return errors
+            return [None] * len(requests)
+        
+        async def forward_to_targets(message_ids, source_id, target_ids):
+            # Targets waiting out a flood wait (or still catching up after one)
+            # are sent to separately, so they don't hold up the rest of the batch
+            from_peer = input_peers[source_id]
+            batch_targets = []
+            single_targets = []
+            delayed_targets = []
+            for target_id in target_ids:
+                if self._in_cooldown(target_id) or target_id in retry_tasks:
+                    delayed_targets.append(target_id)
+                elif isinstance(from_peer, int) or isinstance(input_peers[target_id], int):
+                    # Chats that couldn't be resolved at startup are resolved by
+                    # Telethon per request and may fail, so keep them out of the batch
+                    single_targets.append(target_id)
+                else:
+                    batch_targets.append(target_id)
+            
+            # Send one ForwardMessagesRequest per batched target in a single call,
+            # so Telethon packs them into one MTProto container
+            groups = [[target_id] for target_id in single_targets]
+            if batch_targets:
+                groups.insert(0, batch_targets)
+            results = await asyncio.gather(*(
+                send_requests([
+                    ForwardMessagesRequest(from_peer=from_peer, id=message_ids, to_peer=input_peers[target_id])
+                    for target_id in group
+                ])
+                for group in groups
+            ))
+            sent_targets = [target_id for group in groups for target_id in group]
+            errors = [error for group_errors in results for error in group_errors]
+            
+            for target_id, error in zip(sent_targets, errors):
+                if error is None:
+                    if log_forwards:
+                        logger.info("Successfully forwarded %d message(s) to %s", len(message_ids), info.get(target_id, target_id))
+                elif isinstance(error, FloodWaitError):
+                    self._start_cooldown(target_id, error.seconds)
+                    delayed_targets.append(target_id)
+                else:
+                    logger.error("Error forwarding to %s: %s", info.get(target_id, target_id), error)
+            
+            for target_id in delayed_targets:
+                request = ForwardMessagesRequest(
+                    from_peer=from_peer, id=message_ids, to_peer=input_peers[target_id]
+                )
+                self._delay_send(target_id, functools.partial(client, request), len(message_ids))
+        
+        async def flush_pending(source_id, target_ids):
+            # Keep flushing until no new messages arrived during the last send,
+            # so batches from the same source never overtake each other
+            try:
+                while True:
+                    await asyncio.sleep(FORWARD_BATCH_DELAY)
+                    message_ids = pending.pop(source_id, None)
+                    if not message_ids:
+                        break
+                    
+                    for i in range(0, len(message_ids), MAX_FORWARD_BATCH):
+                        try:
+                            await forward_to_targets(message_ids[i:i + MAX_FORWARD_BATCH], source_id, target_ids)
+                        except Exception as e:
+                            logger.error("Error in forward handler: %s", e)
+            except asyncio.CancelledError:
+                message_ids = pending.pop(source_id, None)
+                if message_ids:
+                    logger.warning("Dropped %d queued message(s) from %s on shutdown", len(message_ids), info.get(source_id, source_id))
+                raise
+            finally:
+                flush_tasks.pop(source_id, None)
+        
+        async def queue_for_targets(message, source_id, target_ids):
+            # Collect messages posted in quick succession (e.g. albums) and
+            # forward them together with a single request per target
+            pending[source_id].append(message.id)
+            if source_id not in flush_tasks:
+                flush_tasks[source_id] = asyncio.create_task(flush_pending(source_id, target_ids))
+        
+        return self._make_handler(queue_for_targets)
+    
+    def _make_send_handler(self):
+        """Build the handler that sends copies of messages without the forward signature."""
+        client = self.client
+        input_peers = self._input_peers
+        info = self._info
+        log_forwards = self.log_forwards
+        html_parser = self._html_parser
+        retry_tasks = self._retry_tasks
+        
+        def make_send(message, target_id):
+            parse_mode = html_parser if message.entities else None
+            media = message.media
+            # Link previews are regenerated by Telegram, so treat them as text
+            if media is None or isinstance(media, MessageMediaWebPage):
+                return functools.partial(
+                    client.send_message,
+                    entity=input_peers[target_id],
+                    message=message.message,
+                    parse_mode=parse_mode
+                )
+            return functools.partial(
+                client.send_file,
+                entity=input_peers[target_id],
+                file=media,
+                caption=message.message,
+                parse_mode=parse_mode
+            )
+        
+        async def send_to_targets(message, source_id, target_ids):
+            # Like in forward mode, targets waiting out a flood wait (or still
+            # catching up after one) get a tracked delayed send instead
+            ready_targets = []
+            for target_id in target_ids:
+                if self._in_cooldown(target_id) or target_id in retry_tasks:
+                    self._delay_send(target_id, make_send(message, target_id), 1)
+                else:
+                    ready_targets.append(target_id)
+            
+            # Send to the other targets concurrently
+            results = await asyncio.gather(
+                *(make_send(message, target_id)() for target_id in ready_targets),
+                return_exceptions=True
+            )
+            for target_id, result in zip(ready_targets, results):
+                if isinstance(result, FloodWaitError):
+                    self._start_cooldown(target_id, result.seconds)
+                    self._delay_send(target_id, make_send(message, target_id), 1)
+                elif isinstance(result, Exception):
+                    logger.error("Error forwarding to %s: %s", info.get(target_id, target_id), result)
+                elif log_forwards:
+                    logger.info("Successfully sent message (without forward signature) to %s", info.get(target_id, target_id))
+        
+        return self._make_handler(send_to_targets)
+    
+    async def setup_forwarding(self):
+        """Set up message forwarding from multiple sources to their respective targets."""
+        # Log all forwarding rules (this also warms the entity info cache)
+        logger.info("Setting up forwarding rules (%d routes):", self._total_targets)
+        for source_id, target_ids in self.forwarding_map.items():
+            source_info = await self.get_entity_info(source_id)
+            self._info[source_id] = source_info
+            target_infos = []
+            for target_id in target_ids:
+                target_info = await self.get_entity_info(target_id)
+                self._info[target_id] = target_info
+                target_infos.append(target_info)
+            logger.info("  %s -> %s", source_info, ', '.join(target_infos))
+        
+        # Resolve every configured chat to an InputPeer once, so sending
+        # doesn't need to look the entity up again for each message
+        for chat_id in self._chat_ids:
+            self._input_peers[chat_id] = await self.resolve_input_peer(chat_id)
+        self.client.session.remember_peers(self._input_peers.values())
+        
+        # Telethon adds marked int IDs to its chats filter as-is, so the raw
+        # source IDs are the cheapest thing to register the handler with
+        source_ids = list(self.forwarding_map)
+        self._source_id_set = frozenset(self.forwarding_map)
+        
+        # The signature option never changes at runtime, so pick the
+        # matching handler once instead of checking it for every message
+        if self.remove_forward_signature:
+            handler = self._make_send_handler()
+        else:
+            handler = self._make_forward_handler()
+        self.client.add_event_handler(handler, events.NewMessage(chats=source_ids))
         
         logger.info("Message forwarding handlers registered successfully")
     
+    async def drain_pending_forwards(self):
+        """Send messages still being batched and give up on ones waiting out a flood wait."""
+        if self._flush_tasks:
+            await asyncio.wait(list(self._flush_tasks.values()))
+        
+        # Delayed sends may be waiting for minutes, so cancel them (each one
+        # logs what it dropped) rather than holding up shutdown
+        delayed_tasks = list(self._delayed_tasks)
+        for task in delayed_tasks:
+            task.cancel()
+        if delayed_tasks:
+            await asyncio.wait(delayed_tasks)
+    
+    async def snapshot_session_periodically(self):
+        """Write the in-memory session to disk every SESSION_SNAPSHOT_INTERVAL seconds."""
+        while True:
+            await asyncio.sleep(SESSION_SNAPSHOT_INTERVAL)
+            try:
+                self.client.session.snapshot()
+            except OSError as e:
+                logger.error("Error saving session snapshot: %s", e)
+    
     async def run(self):
         """Main method to run the forwarder."""
+        snapshot_task = None
         try:
             await self.start_client()
+            
+            # Persist the login right away, then keep the snapshot fresh
+            self.client.session.snapshot()
+            snapshot_task = asyncio.create_task(self.snapshot_session_periodically())
+            
             await self.setup_forwarding()
             
             logger.info("Telegram forwarder is now running. Press Ctrl+C to stop.")
@@ -229,9 +661,13 @@ class TelegramForwarder:
         except KeyboardInterrupt:
             logger.info("Received interrupt signal. Stopping...")
         except Exception as e:
-            logger.error(f"Unexpected error: {e}")
+            logger.error("Unexpected error: %s", e)
         finally:
+            if snapshot_task is not None:
+                snapshot_task.cancel()
+            await self.drain_pending_forwards()
             await self.client.disconnect()
+            self.client.session.snapshot()
             logger.info("Client disconnected")
 
 async def main():
@@ -244,6 +680,9 @@ async def main():
     
     args = parser.parse_args()
     
+    # Load environment variables
+    load_dotenv()
+    
     # Setup logging based on arguments
     setup_logging(disable_console=args.disable_console_log)
     
@@ -251,11 +690,19 @@ async def main():
         forwarder = TelegramForwarder(remove_forward_signature=args.remove_forward_signature)
         await forwarder.run()
     except ValueError as e:
-        logger.error(f"Configuration error: {e}")
+        logger.error("Configuration error: %s", e)
         print("\nPlease check your .env file and ensure all required variables are set.")
         print("You can use .env.example as a template.")
     except Exception as e:
-        logger.error(f"Application error: {e}")
+        logger.error("Application error: %s", e)
+    finally:
+        stop_logging()
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    try:
+        import uvloop
+    except ImportError:
+        # uvloop is optional and not available on Windows
+        asyncio.run(main())
+    else:
+        uvloop.run(main())